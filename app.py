@@ -1,17 +1,10 @@
 import streamlit as st
 import pandas as pd
-import matplotlib.pyplot as plt
+import numpy as np
 from datetime import datetime
-from dateutil.relativedelta import relativedelta
-import calendar
-from functools import lru_cache
+import bisect
 from io import BytesIO
 import streamlit.components.v1 as components
-import socket
-import yfinance as yf
-from yfinance import shared
-shared._USE_THREADS = False
-# yf.pdr_override() removed due to AttributeError
 
 st.set_page_config(page_title="ETF Income Planner", layout="centered")
 st.markdown("""
@@ -27,22 +20,22 @@ dev_code = st.sidebar.text_input("🔐 Developer Access Code", type="password")
 is_developer = dev_code == "letmein123"
 
 # --- IP Address Tracking ---
-@st.cache_data(show_spinner=False)
 def get_client_ip():
-    try:
-        return socket.gethostbyname(socket.gethostname())
-    except:
-        return "unknown"
+    hdrs = st.context.headers
+    return (hdrs.get("X-Forwarded-For") or hdrs.get("X-Real-IP") or "unknown").split(",")[0].strip()
+
+# st.cache_data is shared across sessions, so memoize per session instead
+if "client_ip" not in st.session_state:
+    st.session_state.client_ip = get_client_ip()
 
-client_ip = get_client_ip()
+client_ip = st.session_state.client_ip
 
 # --- Trial Usage State ---
-if "used_ips" not in st.session_state:
-    st.session_state.used_ips = set()
+used_ips = st.session_state.setdefault("used_ips", set())
 
-has_used_trial = client_ip in st.session_state.used_ips
+has_used_trial = client_ip in used_ips
 if not is_developer and not has_used_trial:
-    st.session_state.used_ips.add(client_ip)
+    used_ips.add(client_ip)
 
 # --- Static ETF Data ---
 etf_yields = {
@@ -50,6 +43,12 @@ etf_yields = {
     'QYLD': 0.115, 'RYLD': 0.12, 'BND': 0.04, 'PFF': 0.065
 }
 
+# Parallel arrays for the vectorized yield math. Like the dicts around them they
+# are rebuilt on every Streamlit rerun; at 8 entries that costs next to nothing.
+_ETF_NAMES = tuple(etf_yields)
+_ETF_INDEX = {name: i for i, name in enumerate(_ETF_NAMES)}
+_ETF_YIELDS = np.array([etf_yields[e] for e in _ETF_NAMES], dtype=np.float64)
+
 etf_distribution_schedules = {
     'JEPI': {'frequency': 'monthly', 'next_pay_date': '2024-06-30'},
     'SPYD': {'frequency': 'quarterly', 'next_pay_date': '2024-06-30'},
@@ -61,50 +60,55 @@ etf_distribution_schedules = {
     'PFF': {'frequency': 'monthly', 'next_pay_date': '2024-06-30'}
 }
 
+# Month-end offsets roll next_pay_date forward to the end of its month
+def _pay_dates(sch):
+    n = 12 if sch['frequency'] == 'monthly' else 4
+    step = 1 if n == 12 else 3
+    start = datetime.strptime(sch['next_pay_date'], "%Y-%m-%d")
+    return pd.date_range(start, periods=n, freq=f'{step}ME')
+
+# Pay calendars are static; cache_resource builds them once per process instead
+# of on every script rerun. DatetimeIndex is immutable, so sharing is safe.
+@st.cache_resource(show_spinner=False)
+def _pay_date_table():
+    return {etf: _pay_dates(sch) for etf, sch in etf_distribution_schedules.items()}
+
 state_tax_rates = {
     'Massachusetts': 0.05, 'California': 0.093, 'New York': 0.064, 'Texas': 0.0, 'Florida': 0.0,
     'Illinois': 0.0495, 'Washington': 0.0, 'New Jersey': 0.0637, 'Pennsylvania': 0.0307, 'Ohio': 0.0399
 }
 
 # --- Tax Calculation ---
-@lru_cache(maxsize=None)
+_LIMITS = (11600, 47150, 100525, 191950, 243725, 609350)
+_RATES = (0.10, 0.12, 0.22, 0.24, 0.32, 0.35, 0.37)
+
 def get_federal_tax_rate(income):
-    brackets = [(11600, 0.10), (47150, 0.12), (100525, 0.22),
-                (191950, 0.24), (243725, 0.32), (609350, 0.35)]
-    for limit, rate in brackets:
-        if income <= limit:
-            return rate
-    return 0.37
+    return _RATES[bisect.bisect_left(_LIMITS, income)]
 
 # --- Distribution Schedule ---
-def generate_distribution_schedule(investment, etf_weights):
-    if not etf_weights:
+@st.cache_data(max_entries=128, ttl="1h", show_spinner=False)
+def generate_distribution_schedule(investment: float, etf_items: tuple):
+    if not etf_items:
         return pd.DataFrame()
 
-    rows = []
-    for etf, weight in etf_weights.items():
-        rate = etf_yields[etf]
-        amount = investment * weight * rate
-        sched = etf_distribution_schedules[etf]
-        freq, next_date = sched['frequency'], datetime.strptime(sched['next_pay_date'], "%Y-%m-%d")
-
-        periods = 12 if freq == 'monthly' else 4
-        step = 1 if freq == 'monthly' else 3
-        dist = amount / periods
+    frames = []
+    for etf, weight in etf_items:
+        dates = _pay_date_table()[etf]
+        amt = investment * weight * etf_yields[etf] / len(dates)
+        frames.append(pd.DataFrame({'ETF': etf, 'Pay Date': dates, 'Estimated Distribution ($)': np.round(amt, 2)}))
 
-        for i in range(periods):
-            date = next_date + relativedelta(months=step * i)
-            final_date = datetime(date.year, date.month, calendar.monthrange(date.year, date.month)[1])
-            rows.append({'ETF': etf, 'Pay Date': final_date, 'Estimated Distribution ($)': round(dist, 2)})
-
-    return pd.DataFrame(rows).sort_values('Pay Date')
+    return pd.concat(frames, ignore_index=True).sort_values('Pay Date')
 
 # --- Simulation Logic ---
-def simulate_income_planner(investment, etf_weights, state, income):
-    if not etf_weights:
+@st.cache_data(max_entries=128, ttl="1h", show_spinner=False)
+def simulate_income_planner(investment: float, etf_items: tuple, state, income):
+    if not etf_items:
         return {}
 
-    yield_avg = sum(etf_yields[etf] * w for etf, w in etf_weights.items())
+    n = len(etf_items)
+    idx = np.fromiter((_ETF_INDEX[etf] for etf, _ in etf_items), dtype=np.intp, count=n)
+    w = np.fromiter((weight for _, weight in etf_items), dtype=np.float64, count=n)
+    yield_avg = float(w @ _ETF_YIELDS[idx])
     annual = investment * yield_avg
     monthly = annual / 12
 
@@ -124,22 +128,72 @@ def simulate_income_planner(investment, etf_weights, state, income):
     }
 
 # --- Historical Performance ---
+@st.cache_resource(show_spinner=False)
+def _yf_session():
+    # Shared across reruns and users; don't mutate it from request code.
+    # yfinance only accepts curl_cffi sessions, not requests.Session
+    from curl_cffi import requests
+    return requests.Session(impersonate="chrome")
+
+class DownloadFailed(Exception):
+    """yfinance returned no data at all for the requested tickers."""
+
+@st.cache_data(ttl="6h", max_entries=256, show_spinner=False)
+def _fetch_adj_close(tickers: tuple, start: str, end: str, interval: str) -> pd.DataFrame:
+    # Imported lazily so cold starts don't pay for yfinance until Calculate is pressed
+    import yfinance as yf
+    raw = yf.download(list(tickers), start=start, end=end, interval=interval,
+                      progress=False, threads=True, group_by='ticker', auto_adjust=False,
+                      session=_yf_session())
+    # yfinance swallows network errors and returns an empty frame; raising keeps
+    # that out of the cache (Streamlit doesn't cache exceptions). Partial results
+    # are cached, since a missing ticker is usually a permanent gap (e.g. a window
+    # before the ETF's inception) rather than a transient error.
+    if raw.empty:
+        raise DownloadFailed(", ".join(tickers))
+    if isinstance(raw.columns, pd.MultiIndex):
+        prices = raw.xs('Adj Close', axis=1, level=1)
+    else:
+        prices = raw[['Adj Close']].set_axis(list(tickers), axis=1)
+    return prices.dropna(axis=1, how='all')
+
+@st.cache_resource(show_spinner=False)
+def _growth_kernel():
+    # Lazy like yfinance: numba is only loaded once performance is requested
+    from numba import njit
+
+    @njit(cache=True, fastmath=True)
+    def _weighted_growth(returns, w, out):
+        # Fused dot product + cumulative product in one pass over the returns
+        T, N = returns.shape
+        acc = 1.0
+        for t in range(T):
+            r = 0.0
+            for j in range(N):
+                r += returns[t, j] * w[j]
+            acc *= 1.0 + r
+            out[t] = acc
+
+    return _weighted_growth
+
 def show_portfolio_performance(etf_weights, start, end, interval):
-    prices, returns = pd.DataFrame(), {}
-    for etf, w in etf_weights.items():
-        data = yf.download(etf, start=start, end=end, interval=interval, progress=False, threads=False)
-        if 'Adj Close' not in data:
-            st.warning(f"⚠️ No data found for {etf}. Skipping.")
-            continue
-        data = data['Adj Close']
-        prices[etf] = data
-    rets = prices.pct_change().dropna()
-    matching_weights = {etf: w for etf, w in etf_weights.items() if etf in prices.columns}
-    if not matching_weights:
+    tickers = tuple(sorted(etf_weights))
+    try:
+        prices = _fetch_adj_close(tickers, start.isoformat(), end.isoformat(), interval)
+    except DownloadFailed:
+        prices = pd.DataFrame()
+    for etf in sorted(set(tickers) - set(prices.columns)):
+        st.warning(f"⚠️ No data found for {etf}. Skipping.")
+    w_vec = pd.Series(etf_weights, dtype='float64').reindex(prices.columns).fillna(0.0)
+    if prices.empty or w_vec.sum() <= 0:
         st.error("❌ No valid ETF data available to calculate performance.")
         return
-    weighted = rets[matching_weights.keys()].dot(pd.Series(matching_weights))
-    growth = (1 + weighted).cumprod()
+    w_vec /= w_vec.sum()
+    rets = prices.pct_change().dropna()
+    returns = np.ascontiguousarray(rets.values, dtype=np.float64)
+    out = np.empty(returns.shape[0])
+    _growth_kernel()(returns, w_vec.values.astype(np.float64), out)
+    growth = pd.Series(out, index=rets.index)
     st.markdown("### 📈 Historical Portfolio Performance")
     st.line_chart(growth)
     st.write("Cumulative return: {:.2f}%".format((growth.iloc[-1] - 1) * 100))
@@ -147,34 +201,39 @@ def show_portfolio_performance(etf_weights, start, end, interval):
 # --- UI ---
 st.title("📊 Monthly Income Planner for ETF Investors")
 
-investment = st.number_input("💰 Investment Amount ($)", value=250000)
-income = st.number_input("💼 Your Current Taxable Income ($)", value=145000)
+# Kept outside the form: the weight sliders below depend on it
 selected_etfs = st.multiselect("📊 Select ETFs", list(etf_yields), default=['JEPI', 'SPYD'])
-state = st.selectbox("🌎 Select Your State", list(state_tax_rates), index=0)
-
-etf_weights, total_weight = {}, 0.0
-if selected_etfs:
-    st.markdown("### ⚖️ Assign Portfolio Weights (%)")
-    for etf in selected_etfs:
-        val = st.slider(f"{etf} Weight %", 0, 100, int(100 / len(selected_etfs)))
-        etf_weights[etf] = val / 100
-    total_weight = sum(etf_weights.values())
-
-# --- Date Range & Frequency ---
-st.markdown("### 🕰️ Customize Performance Timeframe")
-start_date = st.date_input("Start Date", datetime(2019, 1, 1))
-end_date = st.date_input("End Date", datetime.today())
-interval = st.selectbox("Frequency", ["1d", "1wk", "1mo"], index=2)
-
-if st.button("📉 Calculate Income"):
+
+with st.form("planner_form"):
+    investment = st.number_input("💰 Investment Amount ($)", value=250000)
+    income = st.number_input("💼 Your Current Taxable Income ($)", value=145000)
+    state = st.selectbox("🌎 Select Your State", list(state_tax_rates), index=0)
+
+    etf_weights_pct = {}
+    if selected_etfs:
+        st.markdown("### ⚖️ Assign Portfolio Weights (%)")
+        for etf in selected_etfs:
+            etf_weights_pct[etf] = st.slider(f"{etf} Weight %", 0, 100, int(100 / len(selected_etfs)))
+
+    # --- Date Range & Frequency ---
+    st.markdown("### 🕰️ Customize Performance Timeframe")
+    start_date = st.date_input("Start Date", datetime(2019, 1, 1))
+    end_date = st.date_input("End Date", datetime.today())
+    interval = st.selectbox("Frequency", ["1d", "1wk", "1mo"], index=2)
+
+    submitted = st.form_submit_button("📉 Calculate Income")
+
+if submitted:
     if is_developer or not has_used_trial:
-        if selected_etfs and investment > 0 and abs(total_weight - 1.0) <= 0.01:
-            summary = simulate_income_planner(investment, etf_weights, state, income)
+        if selected_etfs and investment > 0 and sum(etf_weights_pct.values()) == 100:
+            etf_weights = {k: v / 100 for k, v in etf_weights_pct.items()}
+            etf_items = tuple(sorted(etf_weights.items()))
+            summary = simulate_income_planner(investment, etf_items, state, income)
             st.markdown("### 📋 Income Summary")
             st.dataframe(pd.DataFrame(summary.items(), columns=['Metric', 'Value']))
 
             st.markdown("### 📆 Projected Distribution Schedule")
-            schedule = generate_distribution_schedule(investment, etf_weights)
+            schedule = generate_distribution_schedule(investment, etf_items)
             if not schedule.empty:
                 schedule['Pay Date'] = schedule['Pay Date'].dt.strftime('%Y-%m-%d')
                 st.dataframe(schedule)